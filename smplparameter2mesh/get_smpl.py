@@ -1,27 +1,128 @@
+import io
+import os
 import numpy as np
 import pickle
 import joblib
+import scipy.sparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+  import torch
+except ImportError:
+  torch = None
+
+try:
+  from threadpoolctl import threadpool_limits
+except ImportError:
+  threadpool_limits = None
+
+
+def load_model_params(model_path):
+  """
+  Load SMPL model parameters.
+  Parameter:
+  ---------
+  model_path: Path to the original .pkl, or to a .npz written by
+  `convert_to_npz` which skips unpickling the whole model.
+  Return:
+  ------
+  Dict-like mapping from parameter name to array.
+  """
+  if model_path.endswith('.npz'):
+    with np.load(model_path) as data:
+      return {k: data[k] for k in data.files}
+  with open(model_path, 'rb') as f:
+    return pickle.load(f)
+
+def convert_to_npz(model_path, npz_path=None):
+  """
+  Dump the arrays `SMPLModel` needs from a .pkl model into a .npz, with a
+  dense `J_regressor`. Arrays keep their source dtype, `SMPLModel` casts them
+  to the dtype it runs in.
+  Parameter:
+  ---------
+  model_path: Path to the .pkl model.
+  npz_path: Output path. Defaults to `model_path` with a .npz extension.
+  Return:
+  ------
+  Path of the written .npz.
+  """
+  params = load_model_params(model_path)
+  if npz_path is None:
+    npz_path = os.path.splitext(model_path)[0] + '.npz'
+  J_regressor = params['J_regressor']
+  if scipy.sparse.issparse(J_regressor):
+    J_regressor = J_regressor.toarray()
+  np.savez(
+    npz_path,
+    J_regressor=np.asarray(J_regressor),
+    weights=np.asarray(params['weights']),
+    posedirs=np.asarray(params['posedirs']),
+    v_template=np.asarray(params['v_template']),
+    shapedirs=np.asarray(params['shapedirs']),
+    f=params['f'],
+    kintree_table=params['kintree_table']
+  )
+  return npz_path
+
+
+def _make_fk(parent_idx, batched=False):
+  """
+  Generate the forward kinematics of a kinematic tree as straight-line code,
+  with the parent of every joint hard-coded.
+  Parameter:
+  ---------
+  parent_idx: Parent of joints 1..N-1.
+  batched: Whether G and L carry a leading batch dimension.
+  Return:
+  ------
+  Function `fk(G, L)` that fills the world transformations G of shape
+  [N, 4, 4] (or [batch_size, N, 4, 4]) from the local transformations L of
+  the same shape.
+  """
+  # plain integer indexing, ellipsis indexing is measurably slower here
+  b = ':, ' if batched else ''
+  lines = [f'  G[{b}0] = L[{b}0]']
+  for i, p in enumerate(parent_idx, start=1):
+    lines.append(f'  np.matmul(G[{b}{int(p)}], L[{b}{i}], out=G[{b}{i}])')
+  namespace = {'np': np}
+  exec('def fk(G, L):\n' + '\n'.join(lines) + '\n', namespace)
+  return namespace['fk']
+
 
 class SMPLModel():
-  def __init__(self, model_path):
+  def __init__(self, model_path, dtype=np.float32):
     """
     SMPL model.
     Parameter:
     ---------
     model_path: Path to the SMPL model parameters, pre-processed by
-    `preprocess.py`.
+    `preprocess.py`, or a .npz written by `convert_to_npz`.
+    dtype: Floating point type of the model arrays and all arithmetic.
     """
-    with open(model_path, 'rb') as f:
-      params = pickle.load(f)
+    params = load_model_params(model_path)
+
+    self.J_regressor = params['J_regressor']
+    self.weights = params['weights']
+    self.posedirs = params['posedirs']
 
-      self.J_regressor = params['J_regressor']
-      self.weights = params['weights']
-      self.posedirs = params['posedirs']
-      
-      self.v_template = params['v_template']
-      self.shapedirs = params['shapedirs']
-      self.faces = params['f']
-      self.kintree_table = params['kintree_table']
+    self.v_template = params['v_template']
+    self.shapedirs = params['shapedirs']
+    self.faces = params['f']
+    self.kintree_table = params['kintree_table']
+
+    # float32 by default, which halves the memory traffic of the large model
+    # arrays and is well within SMPL's tolerances, see `test_get_smpl.py`
+    self.dtype = dtype
+    for name in ('weights', 'posedirs', 'v_template', 'shapedirs'):
+      setattr(
+        self, name, np.ascontiguousarray(getattr(self, name), dtype=self.dtype)
+      )
+    # 2-D views of the blend shapes so products with them are plain GEMV/GEMM
+    self._shapedirs_flat = self.shapedirs.reshape(
+      [-1, self.shapedirs.shape[-1]]
+    )
+    self._posedirs_flat = self.posedirs.reshape([-1, self.posedirs.shape[-1]])
 
     id_to_col = {
       self.kintree_table[1, i]: i for i in range(self.kintree_table.shape[1])
@@ -30,19 +131,53 @@ class SMPLModel():
       i: id_to_col[self.kintree_table[0, i]]
       for i in range(1, self.kintree_table.shape[1])
     }
+    # parent of joints 1..23, fixed by the kinematic tree of the model
+    self._parent_idx = np.array(
+      [self.parent[i] for i in range(1, self.kintree_table.shape[1])]
+    )
+    self._fk = _make_fk(self._parent_idx)
+    self._fk_batch = _make_fk(self._parent_idx, batched=True)
 
     self.pose_shape = [24, 3]
     self.beta_shape = [10]
     self.trans_shape = [3]
 
-    self.pose = np.zeros(self.pose_shape)
-    self.beta = np.zeros(self.beta_shape)
-    self.trans = np.zeros(self.trans_shape)
+    self.pose = np.zeros(self.pose_shape, dtype=self.dtype)
+    self.beta = np.zeros(self.beta_shape, dtype=self.dtype)
+    self.trans = np.zeros(self.trans_shape, dtype=self.dtype)
 
     self.verts = None
     self.J = None
     self.R = None
 
+    # the regressor is ~99% zeros, CSR makes `J_regressor.dot` cost O(nnz)
+    self.J_regressor = scipy.sparse.csr_matrix(
+      self.J_regressor, dtype=self.dtype
+    )
+
+    # scratch buffers reused by every `update`
+    n_joints = self.kintree_table.shape[1]
+    n_verts = self.v_template.shape[0]
+    self._I3 = np.eye(3, dtype=self.dtype)
+    # the diagonal of the skew-symmetric matrix is never written, stays zero
+    self._rodrigues_m = np.zeros((n_joints, 3, 3), dtype=self.dtype)
+    self._rodrigues_outer = np.empty((n_joints, 3, 3), dtype=self.dtype)
+    self._v_shaped = np.empty((n_verts, 3), dtype=self.dtype)
+    # beta that `_v_shaped` and `J` were last computed for
+    self._cached_beta = None
+    self._lrotmin = np.empty((n_joints - 1) * 9, dtype=self.dtype)
+    self._v_posed = np.empty((n_verts, 3), dtype=self.dtype)
+    self._L = np.zeros((n_joints, 4, 4), dtype=self.dtype)
+    self._L[:, 3, 3] = 1
+    self._G = np.empty((n_joints, 4, 4), dtype=self.dtype)
+    self._T = np.empty((n_verts, 16), dtype=self.dtype)
+    self._rest_shape_h = np.empty((n_verts, 4), dtype=self.dtype)
+    self._rest_shape_h[:, 3] = 1
+    # faces never change, so their .obj lines are formatted only once
+    faces_io = io.BytesIO()
+    np.savetxt(faces_io, self.faces + 1, fmt='f %d %d %d')
+    self._faces_bytes = faces_io.getvalue()
+
     self.update()
 
   def set_params(self, pose=None, beta=None, trans=None):
@@ -62,142 +197,338 @@ class SMPLModel():
     Updated vertices.
     """
     if pose is not None:
-      self.pose = pose
+      self.pose = np.asarray(pose, dtype=self.dtype)
     if beta is not None:
-      self.beta = beta
+      # private copy, so later in-place edits by the caller can't alias the
+      # beta the shape cache was built from
+      self.beta = np.array(beta, dtype=self.dtype)
     if trans is not None:
-      self.trans = trans
+      self.trans = np.asarray(trans, dtype=self.dtype)
     self.update()
     return self.verts
 
   def update(self):
     """
-    Called automatically when parameters are updated.
+    Called automatically when parameters are updated. The shaped template
+    and joints are only recomputed when beta differs from the last update.
     """
-    # how beta affect body shape
-    v_shaped = self.shapedirs.dot(self.beta) + self.v_template
-    # joints location
-    self.J = self.J_regressor.dot(v_shaped)
+    v_shaped = self._v_shaped
+    beta = np.asarray(self.beta, dtype=self.dtype)
+    if self._cached_beta is None or not np.array_equal(beta, self._cached_beta):
+      # how beta affect body shape
+      np.dot(self._shapedirs_flat, beta, out=v_shaped.reshape(-1))
+      v_shaped += self.v_template
+      # joints location
+      self.J = self.J_regressor.dot(v_shaped)
+      self._cached_beta = beta.copy()
     pose_cube = self.pose.reshape((-1, 1, 3))
-    # rotation matrix for each joint
-    self.R = self.rodrigues(pose_cube)
-    I_cube = np.broadcast_to(
-      np.expand_dims(np.eye(3), axis=0),
-      (self.R.shape[0]-1, 3, 3)
-    )
-    lrotmin = (self.R[1:] - I_cube).ravel()
+    # local transformation of each joint relative to its parent, the bottom
+    # row is filled once in `__init__`; rotations are written straight into
+    # it and `R` and `lrotmin` are derived from that view
+    L = self._L
+    R = self.rodrigues(pose_cube, out=L[:, :3, :3])
+    # `R` gets its own copy so it doesn't change with the next update
+    self.R = R.copy()
+    lrotmin = self._lrotmin
+    np.subtract(R[1:], self._I3, out=lrotmin.reshape([-1, 3, 3]))
     # how pose affect body shape in zero pose
-    v_posed = v_shaped + self.posedirs.dot(lrotmin)
+    v_posed = self._v_posed
+    np.dot(self._posedirs_flat, lrotmin, out=v_posed.reshape(-1))
+    v_posed += v_shaped
     # world transformation of each joint
-    G = np.empty((self.kintree_table.shape[1], 4, 4))
-    G[0] = self.with_zeros(np.hstack((self.R[0], self.J[0, :].reshape([3, 1]))))
-    for i in range(1, self.kintree_table.shape[1]):
-      G[i] = G[self.parent[i]].dot(
-        self.with_zeros(
-          np.hstack(
-            [self.R[i],((self.J[i, :]-self.J[self.parent[i],:]).reshape([3,1]))]
-          )
-        )
-      )
-    G = G - self.pack(
-      np.matmul(
-        G,
-        np.hstack([self.J, np.zeros([24, 1])]).reshape([24, 4, 1])
-        )
-      )
+    n_joints = self.kintree_table.shape[1]
+    L[0, :3, 3] = self.J[0]
+    L[1:, :3, 3] = self.J[1:] - self.J[self._parent_idx]
+    G = self._G
+    self._fk(G, L)
+    # remove the transformation due to the rest pose; only the translation
+    # column is affected
+    G[:, :, 3] -= np.einsum('nij,nj->ni', G[:, :, :3], self.J)
     # transformation of each vertex
-    T = np.tensordot(self.weights, G, axes=[[1], [0]])
-    rest_shape_h = np.hstack((v_posed, np.ones([v_posed.shape[0], 1])))
-    v = np.matmul(T, rest_shape_h.reshape([-1, 4, 1])).reshape([-1, 4])[:, :3]
-    self.verts = v + self.trans.reshape([1, 3])
+    T = np.dot(
+      self.weights, G.reshape([n_joints, 16]), out=self._T
+    ).reshape([-1, 4, 4])
+    rest_shape_h = self._rest_shape_h
+    rest_shape_h[:, :3] = v_posed
+    self.verts = np.einsum('vij,vj->vi', T[:, :3], rest_shape_h)
+    self.verts += self.trans.reshape([1, 3])
 
-  def rodrigues(self, r):
+  def update_batch(self, poses, betas, trans):
+    """
+    Compute vertices for a batch of parameters in one pass. Model state
+    (`pose`, `beta`, `trans`, `verts`, ...) is left untouched.
+    Parameters:
+    ---------
+    poses: Pose parameters of shape [batch_size, 24, 3].
+    betas: Shape parameters of shape [batch_size, 10], or [10] to share one
+    shape across the batch.
+    trans: Global translations of shape [batch_size, 3], or [3].
+    Return:
+    ------
+    Vertices of shape [batch_size, 6890, 3].
+    """
+    poses = np.asarray(poses, dtype=self.dtype).reshape([-1] + self.pose_shape)
+    batch_size = poses.shape[0]
+    n_joints = self.kintree_table.shape[1]
+    betas = np.broadcast_to(
+      np.asarray(betas, dtype=self.dtype), [batch_size] + self.beta_shape
+    )
+    trans = np.broadcast_to(
+      np.asarray(trans, dtype=self.dtype), [batch_size] + self.trans_shape
+    )
+    v_shaped = self.v_template + np.dot(
+      betas, self._shapedirs_flat.T
+    ).reshape([batch_size, -1, 3])
+    # [6890, batch_size * 3] so the regressor is applied with a single product
+    J = self.J_regressor.dot(
+      v_shaped.transpose(1, 0, 2).reshape([v_shaped.shape[1], -1])
+    ).reshape([n_joints, batch_size, 3]).transpose(1, 0, 2)
+    R = self.rodrigues(poses.reshape([-1, 1, 3])).reshape(
+      [batch_size, n_joints, 3, 3]
+    )
+    lrotmin = (R[:, 1:] - self._I3).reshape([batch_size, -1])
+    v_posed = v_shaped + np.dot(
+      lrotmin, self._posedirs_flat.T
+    ).reshape([batch_size, -1, 3])
+    # local transformation of each joint relative to its parent
+    L = np.zeros([batch_size, n_joints, 4, 4], dtype=self.dtype)
+    L[:, :, :3, :3] = R
+    L[:, 0, :3, 3] = J[:, 0]
+    L[:, 1:, :3, 3] = J[:, 1:] - J[:, self._parent_idx]
+    L[:, :, 3, 3] = 1
+    G = np.empty_like(L)
+    self._fk_batch(G, L)
+    G[:, :, :3, 3] -= np.einsum('bnij,bnj->bni', G[:, :, :3, :3], J)
+    # transformation of each vertex, only the [3, 4] part that is kept
+    T = np.matmul(
+      self.weights,
+      np.ascontiguousarray(G[:, :, :3]).reshape([batch_size, n_joints, 12])
+    ).reshape([batch_size, -1, 3, 4])
+    v = np.einsum('bvij,bvj->bvi', T[..., :3], v_posed)
+    v += T[..., 3]
+    return v + trans[:, None, :]
+
+  def rodrigues(self, r, out=None):
     """
     Rodrigues' rotation formula that turns axis-angle vector into rotation
     matrix in a batch-ed manner.
     Parameter:
     ----------
     r: Axis-angle rotation vector of shape [batch_size, 1, 3].
+    out: Optional array of shape [batch_size, 3, 3] to write the result into.
     Return:
     -------
     Rotation matrix of shape [batch_size, 3, 3].
     """
     theta = np.linalg.norm(r, axis=(1, 2), keepdims=True)
     # avoid zero divide
-    theta = np.maximum(theta, np.finfo(np.float64).eps)
-    r_hat = r / theta
+    theta = np.maximum(theta, np.finfo(r.dtype).eps)
+    r_hat = r[:, 0, :] / theta[:, 0, :]
     cos = np.cos(theta)
-    z_stick = np.zeros(theta.shape[0])
-    m = np.dstack([
-      z_stick, -r_hat[:, 0, 2], r_hat[:, 0, 1],
-      r_hat[:, 0, 2], z_stick, -r_hat[:, 0, 0],
-      -r_hat[:, 0, 1], r_hat[:, 0, 0], z_stick]
-    ).reshape([-1, 3, 3])
-    i_cube = np.broadcast_to(
-      np.expand_dims(np.eye(3), axis=0),
-      [theta.shape[0], 3, 3]
-    )
-    A = np.transpose(r_hat, axes=[0, 2, 1])
-    B = r_hat
-    dot = np.matmul(A, B)
-    R = cos * i_cube + (1 - cos) * dot + np.sin(theta) * m
-    return R
+    if (r.shape[0] == self._rodrigues_m.shape[0]
+        and r_hat.dtype == self._rodrigues_m.dtype):
+      m = self._rodrigues_m
+      outer = self._rodrigues_outer
+    else:
+      m = np.zeros((r.shape[0], 3, 3), dtype=r_hat.dtype)
+      outer = np.empty((r.shape[0], 3, 3), dtype=r_hat.dtype)
+    m[:, 0, 1] = -r_hat[:, 2]
+    m[:, 0, 2] = r_hat[:, 1]
+    m[:, 1, 0] = r_hat[:, 2]
+    m[:, 1, 2] = -r_hat[:, 0]
+    m[:, 2, 0] = -r_hat[:, 1]
+    m[:, 2, 1] = r_hat[:, 0]
+    m *= np.sin(theta)
+    np.multiply(r_hat[:, :, None], r_hat[:, None, :], out=outer)
+    outer *= 1 - cos
+    if out is None:
+      out = np.empty((r.shape[0], 3, 3), dtype=r_hat.dtype)
+    np.multiply(cos, self._I3[None, :, :], out=out)
+    out += outer
+    out += m
+    return out
 
-  def with_zeros(self, x):
+  def save_to_obj(self, path):
     """
-    Append a [0, 0, 0, 1] vector to a [3, 4] matrix.
+    Save the SMPL model into .obj file.
     Parameter:
     ---------
-    x: Matrix to be appended.
-    Return:
-    ------
-    Matrix after appending of shape [4,4]
+    path: Path to save.
     """
-    return np.vstack((x, np.array([[0.0, 0.0, 0.0, 1.0]])))
+    save_obj(self.verts, path, self._faces_bytes)
 
-  def pack(self, x):
+class SMPLModelTorch():
+  def __init__(self, model_path, device='cuda'):
     """
-    Append zero matrices of shape [4, 3] to vectors of [4, 1] shape in a batched
-    manner.
+    SMPL model evaluated with PyTorch, for large batches of poses on GPU.
+    Model arrays are kept resident on `device`.
     Parameter:
-    ----------
-    x: Matrices to be appended of shape [batch_size, 4, 1]
+    ---------
+    model_path: Path to the SMPL model parameters, pre-processed by
+    `preprocess.py`, or a .npz written by `convert_to_npz`.
+    device: Device the model lives on.
+    """
+    if torch is None:
+      raise ImportError('SMPLModelTorch requires torch to be installed')
+    smpl = SMPLModel(model_path)
+    self.device = device
+    self.dtype = torch.float32
+    self.faces = smpl.faces
+    self._faces_bytes = smpl._faces_bytes
+    self.pose_shape = smpl.pose_shape
+    self.beta_shape = smpl.beta_shape
+    self.trans_shape = smpl.trans_shape
+
+    def to_device(x):
+      return torch.as_tensor(np.ascontiguousarray(x), device=device)
+    self.v_template = to_device(smpl.v_template)
+    # flattened to [6890 * 3, k], as in `SMPLModel`
+    self.shapedirs = to_device(smpl._shapedirs_flat)
+    self.posedirs = to_device(smpl._posedirs_flat)
+    self.J_regressor = to_device(smpl.J_regressor.toarray())
+    self.weights = to_device(smpl.weights)
+    self._parent_idx = smpl._parent_idx.tolist()
+    self._I3 = torch.eye(3, dtype=self.dtype, device=device)
+
+  def update_batch(self, poses, betas, trans):
+    """
+    Compute vertices for a batch of parameters in one pass.
+    Parameters:
+    ---------
+    poses: Pose parameters of shape [batch_size, 24, 3].
+    betas: Shape parameters of shape [batch_size, 10], or [10] to share one
+    shape across the batch.
+    trans: Global translations of shape [batch_size, 3], or [3].
     Return:
     ------
-    Matrix of shape [batch_size, 4, 4] after appending.
+    Vertices of shape [batch_size, 6890, 3], on the model's device.
     """
-    return np.dstack((np.zeros((x.shape[0], 4, 3)), x))
+    poses = torch.as_tensor(
+      poses, dtype=self.dtype, device=self.device
+    ).reshape([-1] + self.pose_shape)
+    batch_size = poses.shape[0]
+    n_joints = poses.shape[1]
+    betas = torch.as_tensor(
+      betas, dtype=self.dtype, device=self.device
+    ).expand([batch_size] + self.beta_shape)
+    trans = torch.as_tensor(
+      trans, dtype=self.dtype, device=self.device
+    ).expand([batch_size] + self.trans_shape)
+    v_shaped = self.v_template + torch.matmul(
+      betas, self.shapedirs.T
+    ).reshape(batch_size, -1, 3)
+    J = torch.matmul(self.J_regressor, v_shaped)
+    R = self.rodrigues(poses.reshape(-1, 3)).reshape(batch_size, n_joints, 3, 3)
+    lrotmin = (R[:, 1:] - self._I3).reshape(batch_size, -1)
+    v_posed = v_shaped + torch.matmul(
+      lrotmin, self.posedirs.T
+    ).reshape(batch_size, -1, 3)
+    # local transformation of each joint relative to its parent
+    L = torch.zeros(
+      batch_size, n_joints, 4, 4, dtype=self.dtype, device=self.device
+    )
+    L[:, :, :3, :3] = R
+    L[:, 0, :3, 3] = J[:, 0]
+    L[:, 1:, :3, 3] = J[:, 1:] - J[:, self._parent_idx]
+    L[:, :, 3, 3] = 1
+    G = [L[:, 0]]
+    for i in range(1, n_joints):
+      G.append(torch.matmul(G[self._parent_idx[i-1]], L[:, i]))
+    G = torch.stack(G, dim=1)
+    G[:, :, :3, 3] -= torch.einsum('bnij,bnj->bni', G[:, :, :3, :3], J)
+    # transformation of each vertex
+    T = torch.matmul(
+      self.weights, G.reshape(batch_size, n_joints, 16)
+    ).reshape(batch_size, -1, 4, 4)
+    v = torch.einsum('bvij,bvj->bvi', T[:, :, :3, :3], v_posed)
+    return v + T[:, :, :3, 3] + trans[:, None, :]
 
-  def save_to_obj(self, path):
+  def rodrigues(self, r):
     """
-    Save the SMPL model into .obj file.
+    Rodrigues' rotation formula that turns axis-angle vector into rotation
+    matrix in a batch-ed manner.
     Parameter:
-    ---------
-    path: Path to save.
+    ----------
+    r: Axis-angle rotation vector of shape [batch_size, 3].
+    Return:
+    -------
+    Rotation matrix of shape [batch_size, 3, 3].
     """
-    with open(path, 'w') as fp:
-      for v in self.verts:
-        fp.write('v %f %f %f\n' % (v[0], v[1], v[2]))
-      for f in self.faces + 1:
-        fp.write('f %d %d %d\n' % (f[0], f[1], f[2]))
+    theta = torch.linalg.norm(r, dim=1, keepdim=True)
+    # avoid zero divide
+    theta = torch.clamp(theta, min=torch.finfo(r.dtype).eps)
+    r_hat = r / theta
+    cos = torch.cos(theta)[:, :, None]
+    sin = torch.sin(theta)[:, :, None]
+    m = torch.zeros(r.shape[0], 3, 3, dtype=r.dtype, device=r.device)
+    m[:, 0, 1] = -r_hat[:, 2]
+    m[:, 0, 2] = r_hat[:, 1]
+    m[:, 1, 0] = r_hat[:, 2]
+    m[:, 1, 2] = -r_hat[:, 0]
+    m[:, 2, 0] = -r_hat[:, 1]
+    m[:, 2, 1] = r_hat[:, 0]
+    outer = r_hat[:, :, None] * r_hat[:, None, :]
+    return cos * self._I3 + (1 - cos) * outer + sin * m
 
-def save_obj(verts, path):
+def save_obj(verts, path, faces_bytes=b''):
   """
   Save the SMPL model into .obj file.
   Parameter:
   ---------
+  verts: Vertices of shape [N, 3].
   path: Path to save.
+  faces_bytes: Pre-formatted 'f' lines written after the vertices. Vertices
+  only by default.
+  """
+  with open(path, 'wb', buffering=1 << 20) as fp:
+    np.savetxt(fp, verts, fmt='v %f %f %f')
+    fp.write(faces_bytes)
+
+# model owned by each worker process of the `__main__` pool
+_worker_smpl = None
+
+def _init_worker(model_path):
+  """
+  Load the SMPL model once per worker process.
+  Parameter:
+  ---------
+  model_path: Path to the SMPL model parameters.
+  """
+  global _worker_smpl
+  if threadpool_limits is not None:
+    # the pool already runs one process per core, keep BLAS from spawning
+    # its own threads in each of them
+    threadpool_limits(1)
+  _worker_smpl = SMPLModel(model_path)
+
+def _render_batch(args):
+  """
+  Evaluate a batch of poses with the worker's model and save each frame into
+  .obj file.
+  Parameter:
+  ---------
+  args: Tuple of (poses, beta, trans, paths), poses of shape
+  [batch_size, 24, 3] and one path per pose.
   """
-  with open(path, 'w') as fp:
-    for v in verts:
-      fp.write('v %f %f %f\n' % (v[0], v[1], v[2]))
-    #for f in faces + 1:
-    #  fp.write('f %d %d %d\n' % (f[0], f[1], f[2]))
+  poses, beta, trans, paths = args
+  verts = _worker_smpl.update_batch(poses, beta, trans)
+  for v, path in zip(verts, paths):
+    save_obj(v, path, _worker_smpl._faces_bytes)
 
 
 
 if __name__ == '__main__':
-  smpl = SMPLModel('./models/smpl/SMPL_FEMALE.pkl')
+  pkl_path = './models/smpl/SMPL_FEMALE.pkl'
+  model_path = './models/smpl/SMPL_FEMALE.npz'
+  # reconvert when the .pkl was replaced after the .npz was written
+  if (not os.path.exists(model_path)
+      or os.path.getmtime(pkl_path) > os.path.getmtime(model_path)):
+    convert_to_npz(pkl_path, model_path)
+  use_gpu = torch is not None and torch.cuda.is_available()
+  if use_gpu:
+    smpl = SMPLModelTorch(model_path)
+  else:
+    smpl = SMPLModel(model_path)
   np.random.seed(2021)
   beta=np.random.rand(10)*0.1
   trans = np.zeros(smpl.trans_shape)
@@ -237,19 +568,51 @@ if __name__ == '__main__':
   #     smpl.save_to_obj(f'./results/dance_in{j}_{i}.obj')
   numbers=[0,60,120,180,240,360,480]
   cnt=0
+  tasks=[]
   for i in range(6):
     with open(f'../kinectRivised/fps{numbers[i]}.pkl','rb') as f:
       start=pickle.load(f)['pose'].detach().numpy()
-    smpl.set_params(beta=beta,pose=start,trans=trans)
-    smpl.save_to_obj(f'./testobjs/objnew_{cnt}.obj')
+    tasks.append((start,f'./testobjs/objnew_{cnt}.obj'))
     cnt+=1
     middle=np.load(f'../testresults/kinect_outputnew_{numbers[i]}_{numbers[i+1]}.npy')[0]
     for j in range(middle.shape[0]):
       data=middle[j]
-      smpl.set_params(beta=beta,pose=data,trans=trans)
-      smpl.save_to_obj(f'./testobjs/objnew_{cnt}.obj')
+      tasks.append((data,f'./testobjs/objnew_{cnt}.obj'))
       cnt+=1
   with open('../kinectRivised/fps480.pkl','rb') as f:
     data=pickle.load(f)['pose'].detach().numpy()
-    smpl.set_params(beta=beta,pose=data,trans=trans)
-    smpl.save_to_obj(f'./testobjs/objnew_{cnt}.obj')
+    tasks.append((data,f'./testobjs/objnew_{cnt}.obj'))
+  # frames are evaluated in batches through `update_batch`
+  batches = []
+  batch_size = 64 if use_gpu else 32
+  for k in range(0, len(tasks), batch_size):
+    batch = tasks[k:k+batch_size]
+    batches.append((
+      np.stack([t[0].reshape(smpl.pose_shape) for t in batch]),
+      [t[1] for t in batch]
+    ))
+  if use_gpu:
+    # evaluate the batches on GPU, write the files from a thread pool while
+    # the next batch is computed; beta and trans are moved to the device
+    # once, only poses are streamed
+    beta_gpu = torch.as_tensor(beta, dtype=smpl.dtype, device=smpl.device)
+    trans_gpu = torch.as_tensor(trans, dtype=smpl.dtype, device=smpl.device)
+    futures = []
+    with ThreadPoolExecutor() as ex:
+      for poses, paths in batches:
+        verts = smpl.update_batch(poses, beta_gpu, trans_gpu).cpu().numpy()
+        for v, path in zip(verts, paths):
+          futures.append(ex.submit(save_obj, v, path, smpl._faces_bytes))
+    for future in futures:
+      future.result()
+  else:
+    # batches are independent, render them in parallel
+    with ProcessPoolExecutor(
+      max_workers=os.cpu_count(),
+      initializer=_init_worker,
+      initargs=(model_path,)
+    ) as ex:
+      list(ex.map(
+        _render_batch,
+        [(poses, beta, trans, paths) for poses, paths in batches]
+      ))
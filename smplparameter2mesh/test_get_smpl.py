@@ -0,0 +1,55 @@
+import os
+import numpy as np
+import pytest
+
+from get_smpl import SMPLModel, convert_to_npz
+
+MODEL_PATH = os.path.join(
+  os.path.dirname(os.path.abspath(__file__)),
+  'models', 'smpl', 'SMPL_FEMALE.pkl'
+)
+# largest vertex difference allowed between the float32 model and the float64
+# one built from the .pkl
+ATOL = 1e-5
+
+
+@pytest.fixture(scope='module')
+def params():
+  rng = np.random.RandomState(0)
+  poses = rng.randn(8, 24, 3) * 0.4
+  beta = rng.rand(10) * 0.1
+  trans = rng.randn(3)
+  return poses, beta, trans
+
+
+@pytest.fixture(scope='module')
+def expect(params):
+  poses, beta, trans = params
+  smpl = SMPLModel(MODEL_PATH, dtype=np.float64)
+  return smpl.update_batch(poses, beta, trans)
+
+
+def test_float64_npz_matches_pkl(tmp_path, params, expect):
+  poses, beta, trans = params
+  smpl = SMPLModel(
+    convert_to_npz(MODEL_PATH, str(tmp_path / 'smpl.npz')), dtype=np.float64
+  )
+  verts = smpl.update_batch(poses, beta, trans)
+  assert verts.dtype == np.float64
+  np.testing.assert_allclose(verts, expect, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('use_npz', [False, True])
+def test_float32_matches_float64_pkl(tmp_path, params, expect, use_npz):
+  poses, beta, trans = params
+  model_path = MODEL_PATH
+  if use_npz:
+    model_path = convert_to_npz(MODEL_PATH, str(tmp_path / 'smpl.npz'))
+  smpl = SMPLModel(model_path)
+  verts = smpl.update_batch(poses, beta, trans)
+  assert verts.dtype == np.float32
+  np.testing.assert_allclose(verts, expect, rtol=0, atol=ATOL)
+  for pose, v in zip(poses, expect):
+    verts = smpl.set_params(pose=pose, beta=beta, trans=trans)
+    assert verts.dtype == np.float32
+    np.testing.assert_allclose(verts, v, rtol=0, atol=ATOL)